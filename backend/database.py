@@ -1,28 +1,45 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
 
 if not DATABASE_URL:
-    # Local development fallback — SQLite, no PostgreSQL install required
+    # Local development fallback — SQLite via aiosqlite, no PostgreSQL install required
     _db_path = os.path.join(os.path.dirname(__file__), "local_dev.db")
-    DATABASE_URL    = f"sqlite:///{_db_path}"
-    _connect_args   = {"check_same_thread": False}
+    DATABASE_URL    = f"sqlite+aiosqlite:///{_db_path}"
+if DATABASE_URL.startswith("sqlite"):
+    # aiosqlite runs on SQLAlchemy's NullPool, which takes no sizing arguments
+    _engine_kwargs  = {}
 else:
-    # Render provides postgres:// but SQLAlchemy requires postgresql://
+    # Render provides postgres:// but SQLAlchemy requires postgresql:// — and the
+    # async engine needs an explicit async driver (asyncpg)
     if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-    _connect_args = {}
+        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
+    elif DATABASE_URL.startswith("postgresql://"):
+        DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+    _engine_kwargs  = {"pool_size": 20, "max_overflow": 10, "pool_recycle": 1800}
 
-engine = create_engine(DATABASE_URL, connect_args=_connect_args, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_async_engine(DATABASE_URL, pool_pre_ping=True, **_engine_kwargs)
+# expire_on_commit=False: attributes stay loaded after commit, so response
+# serialisation never triggers an implicit (un-awaitable) lazy load
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# Connections opened at startup so the first requests skip the connect handshake
+POOL_WARM_SIZE = 0 if DATABASE_URL.startswith("sqlite") else 5
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+async def warm_pool(size: int = POOL_WARM_SIZE) -> None:
+    """Open `size` pooled connections concurrently, then return them to the pool."""
+    if size <= 0:
+        return
+    conns = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    for conn in conns:
+        await conn.close()
@@ -1,27 +1,40 @@
 import os
 import json
+import time
+import asyncio
 import base64
 import secrets
+import hashlib
+import hmac
 import logging
 import io
-import urllib.request
-from datetime import datetime, date
-
-from fastapi import FastAPI, HTTPException, Depends, Header, Response
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, date, timezone
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import quote
+
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
+from sqlalchemy import func, select, case, update, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from database import get_db, engine
+from database import get_db, engine, SessionLocal, warm_pool
 import models
 import schemas
 
-# Create tables on startup
-models.Base.metadata.create_all(bind=engine)
-
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -29,10 +42,17 @@ DASHBOARD_KEY    = os.environ.get("DASHBOARD_KEY",  "admin321")
 FINANCE_KEY      = os.environ.get("FINANCE_KEY",    "finance123")
 SCANNER_KEY      = os.environ.get("SCANNER_KEY",    "admin123")
 BACKSTAGE_KEY    = os.environ.get("BACKSTAGE_KEY",  "admin")
+# Precomputed key sets for the multi-key auth dependencies
+_ANY_ADMIN_KEYS  = frozenset({DASHBOARD_KEY, FINANCE_KEY, SCANNER_KEY})
+_BACKSTAGE_KEYS  = frozenset({DASHBOARD_KEY, BACKSTAGE_KEY})
+_ALL_ADMIN_KEYS  = _ANY_ADMIN_KEYS | _BACKSTAGE_KEYS
 _raw_origins     = os.environ.get("CORS_ORIGINS", "*")
 CORS_ORIGINS     = [o.strip() for o in _raw_origins.split(",")] if _raw_origins != "*" else ["*"]
 
 BACKEND_URL      = os.environ.get("BACKEND_URL",    "")   # e.g. https://theatre-ticketing-api.onrender.com
+# Create missing tables/indexes at startup. On by default (there are no migrations);
+# set AUTO_CREATE_TABLES=0 once the schema exists so workers skip the DDL probes.
+AUTO_CREATE_TABLES = os.environ.get("AUTO_CREATE_TABLES", "1").strip().lower() not in ("0", "false", "no")
 
 # ── Brevo email config ────────────────────────────────────────────────────────
 # Sign up free at brevo.com → SMTP & API → API Keys → create key.
@@ -42,6 +62,9 @@ BREVO_API_KEY    = os.environ.get("BREVO_API_KEY",    "")
 BREVO_FROM_EMAIL = os.environ.get("BREVO_FROM_EMAIL", os.environ.get("SMTP_FROM", ""))
 BREVO_FROM_NAME  = os.environ.get("BREVO_FROM_NAME",  "Theatre Booking")
 
+# Shared, connection-pooled client for the Brevo API — opened/closed in lifespan()
+BREVO_CLIENT: Optional[httpx.AsyncClient] = None
+
 # ── Default event settings ────────────────────────────────────────────────────
 # These are used when no override exists in the database.
 SETTING_DEFAULTS = {
@@ -65,259 +88,440 @@ SETTING_DEFAULTS = {
     "contact_name":       "",    # name shown in the "if any issue" notice on the booking page
     "contact_phone":      "",    # phone shown in the "if any issue" notice on the booking page
 }
+_ALLOWED_SETTING_KEYS = frozenset(SETTING_DEFAULTS)
 
 
-def get_all_settings(db) -> dict:
-    """Return merged dict: defaults overridden by DB values."""
-    rows = db.query(models.Setting).all()
-    result = dict(SETTING_DEFAULTS)
-    for row in rows:
-        result[row.key] = row.value
-    return result
+# Settings change rarely but are read on every public request — keep the merged
+# dict in-process for a short TTL. update_settings() invalidates it immediately;
+# the TTL bounds staleness across multiple workers.
+SETTINGS_TTL_SECONDS = 30
+_SETTINGS_CACHE: dict = {"at": 0.0, "value": None}
+_SETTINGS_LOCK = asyncio.Lock()
+# Bumped on every invalidation; a refresh that started before the bump must not
+# store what it read, or it would re-cache pre-update rows with a fresh timestamp
+_SETTINGS_VERSION = 0
+
+
+def _settings_cache_fresh() -> bool:
+    return (
+        _SETTINGS_CACHE["value"] is not None
+        and time.monotonic() - _SETTINGS_CACHE["at"] < SETTINGS_TTL_SECONDS
+    )
+
+
+def _invalidate_settings_cache() -> None:
+    global _SETTINGS_VERSION
+    _SETTINGS_VERSION += 1
+    _SETTINGS_CACHE["at"] = 0.0
+
+
+def _to_int(value, default: Optional[int] = None) -> Optional[int]:
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_settings(raw: dict) -> dict:
+    """Decode the values the hot paths need (ints, JSON lists) once per cache refresh."""
+    # Prefer show_dates_json (per-date rows) over legacy comma-separated show_dates
+    show_dates = None
+    if raw.get("show_dates_json", ""):
+        try:
+            show_dates = [
+                d["date"].strip() for d in json.loads(raw["show_dates_json"])
+                if d.get("date", "").strip()
+            ]
+        except Exception:
+            pass
+    if show_dates is None:
+        show_dates = [d.strip() for d in raw["show_dates"].split(",") if d.strip()]
+
+    total_capacity   = _to_int(raw.get("total_capacity", "100"), 100)
+    early_bird_limit = _to_int(raw.get("early_bird_limit", "30") or "30", 30)
+    standard_limit   = _to_int(raw.get("standard_limit", ""))
+
+    # Type definitions from ticket_types_json, or fall back to legacy fields
+    ticket_types = None
+    if raw.get("ticket_types_json", ""):
+        try:
+            parsed = json.loads(raw["ticket_types_json"])
+            if isinstance(parsed, list):
+                # Drop malformed entries rather than fail the whole settings load;
+                # anything other than a list means legacy mode
+                ticket_types = [
+                    t for t in parsed
+                    if isinstance(t, dict) and isinstance(t.get("name"), str) and t["name"]
+                ] or None
+        except Exception:
+            pass
+    type_defs = ticket_types or [
+        {"name": "Early Bird", "limit": early_bird_limit},
+        {"name": "Standard",   "limit": standard_limit if standard_limit is not None else ""},
+    ]
+    # {type name: limit} for every type that has a limit set
+    type_limits = {}
+    for tdef in type_defs:
+        limit = _to_int(tdef.get("limit", ""))
+        if limit is not None:
+            type_limits[tdef["name"]] = limit
+
+    # If every defined type has a limit, the effective capacity = sum of those limits.
+    # This ensures the show-date "X seats left" reflects the actual seats on sale,
+    # not the raw total_capacity setting.
+    if type_limits and len(type_limits) == len(type_defs):
+        effective_capacity = sum(type_limits.values())
+    else:
+        effective_capacity = total_capacity
+
+    return {
+        "show_dates":         show_dates,
+        "total_capacity":     total_capacity,
+        "early_bird_limit":   early_bird_limit,
+        "standard_limit":     standard_limit,
+        "ticket_types":       ticket_types,   # None → legacy Early Bird / Standard mode
+        "type_limits":        type_limits,
+        "effective_capacity": effective_capacity,
+    }
+
+
+async def _load_settings(db: AsyncSession) -> dict:
+    """Return the cached {"raw": ..., "typed": ...} settings entry, refreshing it if stale."""
+    if _settings_cache_fresh():
+        return _SETTINGS_CACHE["value"]
+    async with _SETTINGS_LOCK:
+        # Another request may have refreshed the cache while we waited
+        if _settings_cache_fresh():
+            return _SETTINGS_CACHE["value"]
+        version = _SETTINGS_VERSION
+        rows = (await db.scalars(select(models.Setting))).all()
+        raw = dict(SETTING_DEFAULTS)
+        for row in rows:
+            raw[row.key] = row.value
+        entry = {"raw": raw, "typed": _parse_settings(raw)}
+        if version == _SETTINGS_VERSION:
+            _SETTINGS_CACHE["value"] = entry
+            _SETTINGS_CACHE["at"]    = time.monotonic()
+    return entry
+
+
+async def get_all_settings(db: AsyncSession) -> dict:
+    """Return merged dict: defaults overridden by DB values (cached, treat as read-only)."""
+    return (await _load_settings(db))["raw"]
+
+
+async def get_typed_settings(db: AsyncSession) -> dict:
+    """Return the decoded settings built by _parse_settings (cached, treat as read-only)."""
+    return (await _load_settings(db))["typed"]
 
 
 # ── Email helpers ─────────────────────────────────────────────────────────────
 
+@lru_cache(maxsize=4096)
+def _render_qr_png(ticket_id: str) -> bytes:
+    """Encode ticket_id as a QR PNG. Cached — a ticket's QR never changes."""
+    import qrcode
+    from qrcode.image.pil import PilImage
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=8,
+        border=2,
+        # A fixed mask skips the 8-way mask penalty search that dominates
+        # encode time; any mask is valid to scanners
+        mask_pattern=0,
+        # Pillow (zlib in C) rather than factory auto-detection / pure-Python PNG
+        image_factory=PilImage,
+    )
+    qr.add_data(ticket_id)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
 def _generate_qr_png_bytes(ticket_id: str) -> bytes:
-    """Return raw PNG bytes of the QR code. Returns b'' on failure."""
+    """Return raw PNG bytes of the QR code. Returns b'' on failure (failures are not cached)."""
     try:
-        import qrcode
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=8,
-            border=2,
-        )
-        qr.add_data(ticket_id)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        return buf.getvalue()
+        return _render_qr_png(ticket_id)
     except Exception as e:
         logger.warning(f"QR generation failed: {e}")
         return b""
 
 
+@lru_cache(maxsize=128)
 def _format_date(iso_date: str) -> str:
     """Convert '2026-04-19' → 'Sunday, 19 April 2026, 4.00pm-6.30pm'."""
     try:
         d = date.fromisoformat(iso_date)
-        return d.strftime("%A, %-d %B %Y")
+        # d.day instead of the glibc-only %-d, so this also works on Windows
+        return f"{d.strftime('%A')}, {d.day} {d.strftime('%B %Y')}"
     except Exception:
         return iso_date
 
 
-def _build_email_html(ticket, settings: dict, qr_url: str) -> str:
+def _ticket_snapshot(ticket: models.Ticket) -> dict:
+    """Copy the fields the confirmation email needs into a plain, session-free dict."""
+    return {
+        "ticket_id":      ticket.ticket_id,
+        "name":           ticket.name,
+        "email":          ticket.email,
+        "ticket_type":    ticket.ticket_type,
+        "show_date":      ticket.show_date,
+        "quantity":       ticket.quantity,
+        "payment_status": ticket.payment_status,
+    }
+
+
+# Loaded and compiled once at import; autoescape keeps guest-supplied text (e.g. names)
+# inert. The bytecode cache lets restarted workers skip re-compiling the template.
+_TEMPLATE_DIR       = os.path.join(os.path.dirname(__file__), "templates")
+_JINJA_CACHE_DIR    = os.path.join(os.path.dirname(__file__), ".jinja_cache")
+os.makedirs(_JINJA_CACHE_DIR, exist_ok=True)
+_JINJA_ENV = Environment(
+    loader=FileSystemLoader(_TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache(_JINJA_CACHE_DIR),
+)
+_CONFIRMATION_EMAIL = _JINJA_ENV.get_template("confirmation.html")
+
+
+def _build_email_html(ticket: dict, settings: dict, qr_url: str) -> str:
     """Build a beautiful HTML confirmation email."""
-    event_name  = settings.get("event_name", "Theatre Event")
-    show_date   = _format_date(ticket.show_date)
-    qty_label   = f'{ticket.quantity} ticket{"s" if ticket.quantity > 1 else ""}'
-
-    qr_img_html = (
-        f'<img src="{qr_url}" alt="Entry QR Code" '
-        'width="200" height="200" style="display:block;margin:0 auto;" />'
-        if qr_url
-        else '<p style="text-align:center;color:#888;font-size:13px;">QR code unavailable</p>'
+    return _CONFIRMATION_EMAIL.render(
+        event_name = settings.get("event_name", "Theatre Event"),
+        show_date  = _format_date(ticket["show_date"]),
+        ticket     = ticket,
+        qr_url     = qr_url,
+        pending    = ticket["payment_status"] == "pending",
     )
 
-    receipt_notice = "" if ticket.payment_status != "pending" else """
-        <tr>
-          <td style="padding:0 40px 24px;background:#ffffff;">
-            <div style="background:#fff7ed;border-left:4px solid #ea6d0a;border-radius:6px;padding:14px 18px;">
-              <p style="color:#7a3500;font-size:13px;margin:0;line-height:1.5;">
-                <strong>⚠ Receipt not yet uploaded.</strong><br>
-                Please upload your payment receipt via the registration page to fully confirm your booking.
-              </p>
-            </div>
-          </td>
-        </tr>"""
-
-    return f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <title>Booking Confirmed — {event_name}</title>
-</head>
-<body style="margin:0;padding:0;background:#f0eef8;font-family:'Segoe UI',Helvetica,Arial,sans-serif;">
-  <table width="100%" cellpadding="0" cellspacing="0" style="background:#f0eef8;padding:40px 16px;">
-    <tr><td align="center">
-      <table width="560" cellpadding="0" cellspacing="0"
-             style="background:#ffffff;border-radius:14px;overflow:hidden;max-width:560px;width:100%;border:1px solid #ddd8f0;">
-
-        <!-- ── Header ── -->
-        <tr>
-          <td style="background:linear-gradient(135deg,#2d1b69 0%,#7c3aed 100%);padding:36px 40px;text-align:center;">
-            <p style="color:#e9d8ff;font-size:11px;letter-spacing:3px;text-transform:uppercase;margin:0 0 10px;">
-              ✓ &nbsp; Booking Confirmed
-            </p>
-            <h1 style="color:#ffffff;font-size:26px;margin:0;font-weight:700;line-height:1.3;">
-              {event_name}
-            </h1>
-          </td>
-        </tr>
-
-        <!-- ── Greeting ── -->
-        <tr>
-          <td style="padding:30px 40px 12px;background:#ffffff;">
-            <p style="color:#1a1035;font-size:16px;margin:0 0 8px;">
-              Hello, <strong style="color:#1a1035;">{ticket.name}</strong> 👋
-            </p>
-            <p style="color:#444466;font-size:14px;margin:0;line-height:1.6;">
-              Your seat is reserved. Show the QR code below at the entrance — the staff will scan it to check you in.
-            </p>
-          </td>
-        </tr>
-
-        <!-- ── Ticket details card ── -->
-        <tr>
-          <td style="padding:16px 40px 24px;background:#ffffff;">
-            <table width="100%" cellpadding="0" cellspacing="0"
-                   style="background:#f7f4ff;border-radius:10px;border:1px solid #d4c8f5;">
-              <tr>
-                <td style="padding:20px 24px;">
-                  <table width="100%" cellpadding="7" cellspacing="0">
-                    <tr>
-                      <td style="color:#6b5b9e;font-size:11px;text-transform:uppercase;letter-spacing:1px;width:38%;vertical-align:top;">
-                        Show Date
-                      </td>
-                      <td style="color:#1a1035;font-size:14px;font-weight:700;">
-                        {show_date}
-                      </td>
-                    </tr>
-                    <tr>
-                      <td style="color:#6b5b9e;font-size:11px;text-transform:uppercase;letter-spacing:1px;vertical-align:top;">
-                        Ticket Type
-                      </td>
-                      <td style="color:#1a1035;font-size:14px;font-weight:700;">
-                        {ticket.ticket_type}
-                      </td>
-                    </tr>
-                    <tr>
-                      <td style="color:#6b5b9e;font-size:11px;text-transform:uppercase;letter-spacing:1px;vertical-align:top;">
-                        Quantity
-                      </td>
-                      <td style="color:#1a1035;font-size:14px;font-weight:700;">
-                        {qty_label}
-                      </td>
-                    </tr>
-                    <tr>
-                      <td style="color:#6b5b9e;font-size:11px;text-transform:uppercase;letter-spacing:1px;vertical-align:top;">
-                        Booking ID
-                      </td>
-                      <td style="color:#5b3fb5;font-size:12px;font-family:'Courier New',monospace;word-break:break-all;">
-                        {ticket.ticket_id}
-                      </td>
-                    </tr>
-                  </table>
-                </td>
-              </tr>
-            </table>
-          </td>
-        </tr>
-
-        <!-- ── QR Code ── -->
-        <tr>
-          <td style="padding:0 40px 28px;text-align:center;background:#ffffff;">
-            <p style="color:#6b5b9e;font-size:11px;text-transform:uppercase;letter-spacing:2px;margin:0 0 14px;font-weight:600;">
-              Scan at Entrance
-            </p>
-            <div style="background:#ffffff;border:2px solid #d4c8f5;border-radius:12px;padding:16px;display:inline-block;">
-              {qr_img_html}
-            </div>
-            <p style="color:#555577;font-size:12px;margin:12px 0 0;">
-              Screenshot or print this email and bring it to the venue.
-            </p>
-          </td>
-        </tr>
-
-        <!-- ── Receipt notice (if pending) ── -->
-        {receipt_notice}
-
-        <!-- ── Footer ── -->
-        <tr>
-          <td style="background:#f7f4ff;border-top:1px solid #ddd8f0;padding:20px 40px;text-align:center;">
-            <p style="color:#6b5b9e;font-size:12px;margin:0;line-height:1.5;">
-              This is an automated confirmation — please do not reply to this email.<br>
-              See you at the show! 🎭
-            </p>
-          </td>
-        </tr>
-
-      </table>
-    </td></tr>
-  </table>
-</body>
-</html>"""
-
-
-def _send_ticket_email(ticket, settings: dict) -> None:
+
+async def _send_ticket_email(ticket: dict, settings: dict) -> bool:
     """
     Send a booking confirmation email via Brevo HTTP API.
-    Non-blocking: any error is logged but NOT re-raised,
-    so registration always succeeds even if email fails.
+    Runs as a background task after the response is sent; any error is
+    logged but NOT re-raised, so registration always succeeds even if email fails.
+    Returns True if Brevo accepted the message.
     """
-    if not BREVO_API_KEY or not BREVO_FROM_EMAIL:
+    if not BREVO_API_KEY or not BREVO_FROM_EMAIL or BREVO_CLIENT is None:
         logger.info(
             "Email not configured (BREVO_API_KEY/BREVO_FROM_EMAIL not set) — "
-            "skipping confirmation email for %s.", ticket.ticket_id
+            "skipping confirmation email for %s.", ticket["ticket_id"]
         )
-        return
+        return False
 
     try:
         # Build a public HTTPS URL for the QR image — email clients fetch it directly.
         # This avoids CID inline attachments which Brevo's REST API doesn't support.
-        qr_url     = f"{BACKEND_URL}/api/ticket/{ticket.ticket_id}/qr" if BACKEND_URL else ""
+        qr_url     = f"{BACKEND_URL}/api/ticket/{ticket['ticket_id']}/qr" if BACKEND_URL else ""
         html_body  = _build_email_html(ticket, settings, qr_url)
         event_name = settings.get("event_name", "Theatre Event")
 
-        payload = json.dumps({
-            "sender":      {"name": BREVO_FROM_NAME, "email": BREVO_FROM_EMAIL},
-            "to":          [{"email": ticket.email, "name": ticket.name}],
-            "subject":     f"🎭 Booking Confirmed — {event_name}",
-            "htmlContent": html_body,
-        }).encode("utf-8")
-
-        req = urllib.request.Request(
-            "https://api.brevo.com/v3/smtp/email",
-            data=payload,
+        # Serialised straight to UTF-8 bytes with orjson (httpx's json= goes via a
+        # str from the stdlib encoder, then encodes it again)
+        resp = await BREVO_CLIENT.post(
+            "/v3/smtp/email",
+            content=orjson.dumps({
+                "sender":      {"name": BREVO_FROM_NAME, "email": BREVO_FROM_EMAIL},
+                "to":          [{"email": ticket["email"], "name": ticket["name"]}],
+                "subject":     f"🎭 Booking Confirmed — {event_name}",
+                "htmlContent": html_body,
+            }),
             headers={
                 "api-key":      BREVO_API_KEY,
-                "Content-Type": "application/json",
                 "Accept":       "application/json",
+                "Content-Type": "application/json",
             },
         )
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            result = json.loads(resp.read())
+        resp.raise_for_status()
         logger.info(
             "Confirmation email sent via Brevo → %s (messageId: %s)",
-            ticket.email, result.get("messageId")
+            ticket["email"], resp.json().get("messageId")
         )
+        return True
 
     except Exception as exc:
         logger.error(
             "Failed to send confirmation email to %s: %s",
-            ticket.email, exc
+            ticket["email"], exc
         )
+        return False
+
+
+# Brevo requests kept in flight at once during a bulk resend
+EMAIL_BULK_CONCURRENCY = 5
+
+
+async def _send_bulk_emails(tickets: list[dict], settings: dict) -> None:
+    """
+    Resend confirmation emails for many tickets as one background task.
+    Sends overlap (up to EMAIL_BULK_CONCURRENCY) on the shared keep-alive
+    Brevo client instead of queueing one full round-trip after another.
+    """
+    semaphore = asyncio.Semaphore(EMAIL_BULK_CONCURRENCY)
+
+    async def _send(ticket: dict) -> bool:
+        async with semaphore:
+            return await _send_ticket_email(ticket, settings)
+
+    results = await asyncio.gather(*(_send(t) for t in tickets))
+    logger.info(
+        "Bulk resend finished: %d of %d confirmation emails sent.",
+        sum(results), len(tickets)
+    )
 
 
 # ── Audit log helper ──────────────────────────────────────────────────────────
 
-def _log_action(db: Session, role: str, action: str, detail: str) -> None:
-    """Insert one audit-log row. Failures are swallowed so they never break the main flow."""
+# Audit rows are queued in memory and committed in batches by _flush_audit_loop(),
+# so a burst of logins/check-ins costs one commit instead of one per action.
+AUDIT_BATCH_SIZE     = 50
+AUDIT_FLUSH_INTERVAL = 1.0   # seconds
+AUDIT_QUEUE: Optional[asyncio.Queue] = None   # created in lifespan() on the serving loop
+
+
+def _log_action(role: str, action: str, detail: str) -> None:
+    """Queue one audit-log row. Failures are swallowed so they never break the main flow."""
     try:
-        entry = models.AuditLog(role=role, action=action, detail=detail)
-        db.add(entry)
-        db.commit()
+        AUDIT_QUEUE.put_nowait({
+            # Stamped now — the row may only be written up to a flush interval later
+            "timestamp": datetime.now(timezone.utc),
+            "role":      role,
+            "action":    action,
+            "detail":    detail,
+        })
     except Exception as exc:
-        logger.warning("Audit log write failed: %s", exc)
+        logger.warning("Audit log enqueue failed: %s", exc)
+
+
+async def _write_audit_rows(rows: list) -> None:
+    """Insert a batch of queued audit rows in one transaction."""
+    try:
+        async with SessionLocal() as session:
+            session.add_all([models.AuditLog(**row) for row in rows])
+            await session.commit()
+    except Exception as exc:
+        logger.warning("Audit log write failed (%d entries): %s", len(rows), exc)
+
+
+async def _flush_audit_loop() -> None:
+    """Commit queued audit rows every AUDIT_FLUSH_INTERVAL or AUDIT_BATCH_SIZE rows.
+    A None on the queue flushes what is pending and stops the loop."""
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        row = await AUDIT_QUEUE.get()
+        if row is None:
+            break
+        rows     = [row]
+        deadline = loop.time() + AUDIT_FLUSH_INTERVAL
+        while len(rows) < AUDIT_BATCH_SIZE:
+            try:
+                row = await asyncio.wait_for(AUDIT_QUEUE.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            rows.append(row)
+        await _write_audit_rows(rows)
 
 
 # ── FastAPI app ───────────────────────────────────────────────────────────────
 
-app = FastAPI(title="Theatre Ticketing API", version="1.0.0")
+# Arbitrary pg_advisory_xact_lock key that serialises schema creation across workers
+_SCHEMA_LOCK_KEY = 0x5EA7
+
+
+def _create_schema(conn) -> None:
+    """Create missing tables, then any indexes added to existing tables since."""
+    models.Base.metadata.create_all(conn)
+    # create_all skips tables that already exist, so new indexes need their own pass
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global BREVO_CLIENT, AUDIT_QUEUE
+    if AUTO_CREATE_TABLES:
+        async with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                # Workers boot together; without the lock they race on the same CREATEs
+                await conn.execute(
+                    text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK_KEY}
+                )
+            await conn.run_sync(_create_schema)
+    # Pay connection setup and the first settings load before accepting traffic
+    await warm_pool()
+    async with SessionLocal() as db:
+        await get_all_settings(db)
+    BREVO_CLIENT = httpx.AsyncClient(
+        base_url="https://api.brevo.com",
+        timeout=15,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            # Keep the TLS connection warm between registrations (httpx default
+            # expiry is 5s) so sporadic sends skip the handshake
+            limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=120),
+            # Reconnect once if opening a connection fails
+            retries=1,
+        ),
+    )
+    AUDIT_QUEUE = asyncio.Queue()
+    audit_task  = asyncio.create_task(_flush_audit_loop())
+    yield
+    # Flush any audit rows still queued before the process exits
+    AUDIT_QUEUE.put_nowait(None)
+    await audit_task
+    await BREVO_CLIENT.aclose()
+    BREVO_CLIENT = None
+    await engine.dispose()
+
+
+app = FastAPI(
+    title="Theatre Ticketing API",
+    version="1.0.0",
+    lifespan=lifespan,
+    # orjson encodes in native code — noticeably faster on the ticket list
+    default_response_class=ORJSONResponse,
+)
+
+# Binary bodies that are already compressed (receipt JPEG/PNG/PDF, QR PNGs) —
+# gzip only burns CPU on them
+_GZIP_SKIP_TYPES = ("image/", "application/pdf")
+
+
+class _SkipCompressedGZipResponder(GZipResponder):
+    async def send_with_gzip(self, message) -> None:
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(_GZIP_SKIP_TYPES):
+                # Starlette passes bodies through untouched once it thinks they're encoded
+                self.content_encoding_set = True
+
+
+class _SkipCompressedGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves already-compressed content types alone
+    (Starlette 0.41 has no content-type exclusions of its own)."""
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _SkipCompressedGZipResponder(
+                self.app, self.minimum_size, compresslevel=self.compresslevel
+            )
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# Ticket lists, audit log and settings (base64 images) compress 5–10×.
+# Added before CORS so CORS stays outermost and decorates the compressed response.
+app.add_middleware(_SkipCompressedGZipMiddleware, minimum_size=1024, compresslevel=5)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
@@ -331,25 +535,86 @@ app.add_middleware(
 # Auth dependencies
 # ---------------------------------------------------------------------------
 
-def verify_dashboard(x_admin_key: str = Header(..., alias="X-Admin-Key")):
+def _key_matches(supplied: str, *keys: str) -> bool:
+    """Constant-time check of a supplied key against one or more secrets.
+    Every key is compared (no short-circuit) so timing reveals nothing."""
+    supplied_bytes = supplied.encode()
+    matched = False
+    for key in keys:
+        matched |= hmac.compare_digest(supplied_bytes, key.encode())
+    return matched
+
+
+# ── Login rate limit ─────────────────────────────────────────────────────────
+# Failed admin-key attempts per client (login ping and every admin route) within a
+# sliding window; beyond the limit the client gets 429 until old failures age out.
+LOGIN_MAX_FAILURES   = 10
+LOGIN_FAILURE_WINDOW = 60      # seconds
+LOGIN_TRACKED_MAX    = 10_000  # distinct clients tracked before expired entries are swept
+_LOGIN_FAILURES: dict = {}     # client ip -> deque of failure times (monotonic)
+
+
+def _client_ip(request: Request) -> str:
+    """Client address as resolved by uvicorn. X-Forwarded-For is only honoured for
+    the proxy addresses in --forwarded-allow-ips (see render.yaml), so clients can't
+    spoof it to dodge the login limit."""
+    return request.client.host if request.client else "unknown"
+
+
+def _login_blocked(ip: str) -> bool:
+    failures = _LOGIN_FAILURES.get(ip)
+    if not failures:
+        return False
+    cutoff = time.monotonic() - LOGIN_FAILURE_WINDOW
+    while failures and failures[0] < cutoff:
+        failures.popleft()
+    if not failures:
+        del _LOGIN_FAILURES[ip]
+        return False
+    return len(failures) >= LOGIN_MAX_FAILURES
+
+
+def _record_login_failure(ip: str) -> None:
+    now = time.monotonic()
+    if ip not in _LOGIN_FAILURES and len(_LOGIN_FAILURES) >= LOGIN_TRACKED_MAX:
+        # Clients that never come back are otherwise never removed
+        cutoff = now - LOGIN_FAILURE_WINDOW
+        for stale in [k for k, f in _LOGIN_FAILURES.items() if not f or f[-1] < cutoff]:
+            del _LOGIN_FAILURES[stale]
+        if len(_LOGIN_FAILURES) >= LOGIN_TRACKED_MAX:
+            # Still full of live entries — forget the longest-tracked client
+            del _LOGIN_FAILURES[next(iter(_LOGIN_FAILURES))]
+    _LOGIN_FAILURES.setdefault(ip, deque(maxlen=LOGIN_MAX_FAILURES)).append(now)
+
+
+def _require_key(request: Request, supplied: str, *keys: str, detail: str = "Invalid key") -> None:
+    """Shared admin-key check: 429 while the client is rate-limited, 401 when the key
+    doesn't match. Only unknown keys count towards the limit — a valid key used on a
+    route its role can't access is not a guess."""
+    ip = _client_ip(request)
+    if _login_blocked(ip):
+        raise HTTPException(status_code=429, detail="Too many failed attempts. Try again later.")
+    if not _key_matches(supplied, *keys):
+        if not _key_matches(supplied, *_ALL_ADMIN_KEYS):
+            _record_login_failure(ip)
+        raise HTTPException(status_code=401, detail=detail)
+
+
+async def verify_dashboard(request: Request, x_admin_key: str = Header(..., alias="X-Admin-Key")):
     """Full admin access — required for write operations (edit, delete, settings)."""
-    if x_admin_key != DASHBOARD_KEY:
-        raise HTTPException(status_code=401, detail="Invalid dashboard key")
+    _require_key(request, x_admin_key, DASHBOARD_KEY, detail="Invalid dashboard key")
 
-def verify_backstage(x_admin_key: str = Header(..., alias="X-Admin-Key")):
+async def verify_backstage(request: Request, x_admin_key: str = Header(..., alias="X-Admin-Key")):
     """Audit log access — accepts dashboard key or dedicated backstage key."""
-    if x_admin_key not in (DASHBOARD_KEY, BACKSTAGE_KEY):
-        raise HTTPException(status_code=401, detail="Invalid key")
+    _require_key(request, x_admin_key, *_BACKSTAGE_KEYS)
 
-def verify_any_admin(x_admin_key: str = Header(..., alias="X-Admin-Key")):
+async def verify_any_admin(request: Request, x_admin_key: str = Header(..., alias="X-Admin-Key")):
     """Read-only admin access — accepts dashboard, finance, and scanner keys."""
-    if x_admin_key not in (DASHBOARD_KEY, FINANCE_KEY, SCANNER_KEY):
-        raise HTTPException(status_code=401, detail="Invalid key")
+    _require_key(request, x_admin_key, *_ANY_ADMIN_KEYS)
 
-def verify_scanner(x_admin_key: str = Header(..., alias="X-Admin-Key")):
+async def verify_scanner(request: Request, x_admin_key: str = Header(..., alias="X-Admin-Key")):
     """Required by scanner route — check-in only."""
-    if x_admin_key != SCANNER_KEY:
-        raise HTTPException(status_code=401, detail="Invalid scanner key")
+    _require_key(request, x_admin_key, SCANNER_KEY, detail="Invalid scanner key")
 
 
 # ---------------------------------------------------------------------------
@@ -357,59 +622,74 @@ def verify_scanner(x_admin_key: str = Header(..., alias="X-Admin-Key")):
 # ---------------------------------------------------------------------------
 
 @app.get("/api/health")
-def health_check():
+async def health_check():
     return {"status": "ok"}
 
 
 @app.get("/api/ticket/{ticket_id}/qr")
-def get_ticket_qr(ticket_id: str):
+def get_ticket_qr(
+    ticket_id: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
     """Public endpoint — generates and serves the QR code PNG for a ticket.
-    Used by confirmation emails so the image is fetched via HTTPS (no CID needed)."""
+    Used by confirmation emails so the image is fetched via HTTPS (no CID needed).
+    The image for a ticket_id never changes, so clients may cache it forever."""
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag":          f'"{hashlib.md5(ticket_id.encode()).hexdigest()}"',
+    }
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
     png = _generate_qr_png_bytes(ticket_id)
     if not png:
         raise HTTPException(status_code=404, detail="QR generation failed")
-    return Response(content=png, media_type="image/png")
+    return Response(content=png, media_type="image/png", headers=headers)
 
 
 @app.get("/api/admin/ping")
-def admin_ping(
+async def admin_ping(
+    request: Request,
     x_admin_key: str = Header(..., alias="X-Admin-Key"),
-    db: Session = Depends(get_db),
 ):
     """Key verification — returns role so the frontend knows what access level was granted."""
-    if x_admin_key == DASHBOARD_KEY:
-        _log_action(db, "Admin", "login", "Logged in as Admin (full access)")
+    ip = _client_ip(request)
+    if _login_blocked(ip):
+        raise HTTPException(status_code=429, detail="Too many failed attempts. Try again later.")
+
+    if _key_matches(x_admin_key, DASHBOARD_KEY):
+        _log_action("Admin", "login", "Logged in as Admin (full access)")
         return {"ok": True, "role": "dashboard"}
-    if x_admin_key == FINANCE_KEY:
-        _log_action(db, "Finance", "login", "Logged in as Finance (view only)")
+    if _key_matches(x_admin_key, FINANCE_KEY):
+        _log_action("Finance", "login", "Logged in as Finance (view only)")
         return {"ok": True, "role": "finance"}
-    if x_admin_key == SCANNER_KEY:
-        _log_action(db, "Scanner", "login", "Logged in as Scanner (view only)")
+    if _key_matches(x_admin_key, SCANNER_KEY):
+        _log_action("Scanner", "login", "Logged in as Scanner (view only)")
         return {"ok": True, "role": "scanner"}
-    if x_admin_key == BACKSTAGE_KEY:
-        _log_action(db, "Admin", "login", "Logged in to Backstage")
+    if _key_matches(x_admin_key, BACKSTAGE_KEY):
+        _log_action("Admin", "login", "Logged in to Backstage")
         return {"ok": True, "role": "backstage"}
+
+    _record_login_failure(ip)
     raise HTTPException(status_code=401, detail="Invalid key")
 
 
 @app.get("/api/settings")
-def get_settings(db: Session = Depends(get_db)):
+async def get_settings(db: AsyncSession = Depends(get_db)):
     """Public — returns all event settings (used by registration page on load)."""
-    return get_all_settings(db)
+    return await get_all_settings(db)
 
 
 @app.put(
     "/api/admin/settings",
     dependencies=[Depends(verify_dashboard)],
 )
-def update_settings(payload: dict, db: Session = Depends(get_db)):
+async def update_settings(payload: dict, db: AsyncSession = Depends(get_db)):
     """Save updated event settings (dashboard key required)."""
-    allowed_keys = set(SETTING_DEFAULTS.keys())
     changed = []
     for key, value in payload.items():
-        if key not in allowed_keys:
+        if key not in _ALLOWED_SETTING_KEYS:
             continue
-        row = db.query(models.Setting).filter(models.Setting.key == key).first()
+        row = await db.scalar(select(models.Setting).where(models.Setting.key == key))
         if row:
             if row.value != str(value):
                 changed.append(f"{key}='{value}'")
@@ -417,96 +697,54 @@ def update_settings(payload: dict, db: Session = Depends(get_db)):
         else:
             db.add(models.Setting(key=key, value=str(value)))
             changed.append(f"{key}='{value}'")
-    db.commit()
+    await db.commit()
+    _invalidate_settings_cache()
     if changed:
-        _log_action(db, "Admin", "update_settings", "Updated settings: " + ", ".join(changed))
-    return get_all_settings(db)
+        _log_action("Admin", "update_settings", "Updated settings: " + ", ".join(changed))
+    return await get_all_settings(db)
 
 
-def _early_bird_sold(db: Session, show_date: str) -> int:
-    """Return total Early Bird tickets sold (sum of quantities) for a show date."""
-    return _type_sold(db, "Early Bird", show_date)
+async def _sold_by_date_and_type(db: AsyncSession, show_dates: list) -> dict:
+    """Return {show_date: {ticket_type: sold}} for the given dates in a single GROUP BY query."""
+    rows = (await db.execute(
+        select(models.Ticket.show_date, models.Ticket.ticket_type, func.sum(models.Ticket.quantity))
+        .where(models.Ticket.show_date.in_(show_dates))
+        .group_by(models.Ticket.show_date, models.Ticket.ticket_type)
+    )).all()
+    sold: dict = {}
+    for show_date, ticket_type, qty in rows:
+        sold.setdefault(show_date, {})[ticket_type] = qty or 0
+    return sold
 
 
-def _type_sold(db: Session, ticket_type: str, show_date: str) -> int:
-    """Return tickets sold (sum of quantities) for any ticket type + show date."""
-    result = (
-        db.query(func.sum(models.Ticket.quantity))
-        .filter(
-            models.Ticket.show_date   == show_date,
-            models.Ticket.ticket_type == ticket_type,
-        )
-        .scalar()
-    )
-    return result or 0
-
-
-def _total_sold(db: Session, show_date: str) -> int:
-    """Return total tickets sold (all types, sum of quantities) for a show date."""
-    result = (
-        db.query(func.sum(models.Ticket.quantity))
-        .filter(models.Ticket.show_date == show_date)
-        .scalar()
-    )
-    return result or 0
+async def _sold_by_type(db: AsyncSession, show_date: str) -> dict:
+    """Return {ticket_type: sold} for one show date (single GROUP BY query)."""
+    return (await _sold_by_date_and_type(db, [show_date])).get(show_date, {})
 
 
 @app.get("/api/availability")
-def get_availability(db: Session = Depends(get_db)):
+async def get_availability(db: AsyncSession = Depends(get_db)):
     """Public — returns Early Bird and total capacity info per show date."""
-    settings = get_all_settings(db)
-    # Prefer show_dates_json (per-date rows) over legacy comma-separated show_dates
-    _sdj = settings.get("show_dates_json", "")
-    if _sdj:
-        try:
-            _date_defs = json.loads(_sdj)
-            show_dates = [d["date"].strip() for d in _date_defs if d.get("date", "").strip()]
-        except Exception:
-            show_dates = [d.strip() for d in settings["show_dates"].split(",") if d.strip()]
-    else:
-        show_dates = [d.strip() for d in settings["show_dates"].split(",") if d.strip()]
-    total_capacity  = int(settings.get("total_capacity", "100"))
+    settings           = await get_typed_settings(db)
+    show_dates         = settings["show_dates"]
+    effective_capacity = settings["effective_capacity"]
 
-    # Build type definitions from ticket_types_json, or fall back to legacy fields
-    types_json = settings.get("ticket_types_json", "")
-    type_defs: list = []
-    if types_json:
-        try:
-            type_defs = json.loads(types_json)
-        except Exception:
-            pass
-    if not type_defs:
-        type_defs = [
-            {"name": "Early Bird", "limit": settings.get("early_bird_limit", "30")},
-            {"name": "Standard",   "limit": settings.get("standard_limit",   "")},
-        ]
-
-    # If every defined type has a limit, the effective capacity = sum of those limits.
-    # This ensures the show-date "X seats left" reflects the actual seats on sale,
-    # not the raw total_capacity setting.
-    type_limits = [int(str(t.get("limit", "")).strip()) for t in type_defs if str(t.get("limit", "")).strip()]
-    if len(type_limits) == len(type_defs) and type_limits:
-        effective_capacity = sum(type_limits)
-    else:
-        effective_capacity = total_capacity
+    sold_by_date = await _sold_by_date_and_type(db, show_dates) if show_dates else {}
 
     result = {}
     for date in show_dates:
-        total_sold      = _total_sold(db, date)
+        sold_by_type    = sold_by_date.get(date, {})
+        total_sold      = sum(sold_by_type.values())
         total_remaining = max(0, effective_capacity - total_sold)
 
         # Compute per-type remaining for every type that has a limit set
         types_data: dict = {}
-        for tdef in type_defs:
-            name    = tdef["name"]
-            lim_str = str(tdef.get("limit", "")).strip()
-            if lim_str:
-                lim  = int(lim_str)
-                sold = _type_sold(db, name, date)
-                types_data[name] = {
-                    "remaining": max(0, lim - sold),
-                    "sold_out":  sold >= lim,
-                }
+        for name, lim in settings["type_limits"].items():
+            sold = sold_by_type.get(name, 0)
+            types_data[name] = {
+                "remaining": max(0, lim - sold),
+                "sold_out":  sold >= lim,
+            }
 
         # Keep backward-compatible Early Bird top-level fields
         eb = types_data.get("Early Bird", {})
@@ -521,17 +759,32 @@ def get_availability(db: Session = Depends(get_db)):
     return result
 
 
+def _new_ticket_id() -> str:
+    """Time-ordered ticket id, UUIDv7-style: 48-bit millisecond timestamp + 80 random bits.
+    Upper-case hex keeps string order equal to time order (base64 would not), so new
+    ids land at the right edge of the primary-key B-tree; it fits String(32) and encodes
+    in QR alphanumeric mode at the same QR version as before. The random part still
+    comes from the CSPRNG because the id doubles as the entry credential."""
+    millis = time.time_ns() // 1_000_000
+    return (millis.to_bytes(6, "big") + secrets.token_bytes(10)).hex().upper()
+
+
 @app.post("/api/register", response_model=schemas.TicketResponse, status_code=201)
-def register_ticket(
+async def register_ticket(
     ticket: schemas.TicketCreate,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
 ):
     # Fetch settings once (needed for Early Bird check + email)
-    settings = get_all_settings(db)
+    settings       = await get_all_settings(db)
+    settings_typed = await get_typed_settings(db)
+
+    # One aggregate query covers every capacity check below
+    sold_by_type = await _sold_by_type(db, ticket.show_date)
 
     # Enforce total venue capacity first
-    total_capacity  = int(settings.get("total_capacity", "100"))
-    total_sold      = _total_sold(db, ticket.show_date)
+    total_capacity  = settings_typed["total_capacity"]
+    total_sold      = sum(sold_by_type.values())
     total_remaining = max(0, total_capacity - total_sold)
     if ticket.quantity > total_remaining:
         raise HTTPException(
@@ -543,30 +796,24 @@ def register_ticket(
         )
 
     # Enforce per-type capacity limits
-    types_json = settings.get("ticket_types_json", "")
-    if types_json:
+    if settings_typed["ticket_types"] is not None:
         # Dynamic ticket types — check limit from ticket_types_json
-        try:
-            type_defs = json.loads(types_json)
-            tdef = next((t for t in type_defs if t["name"] == ticket.ticket_type), None)
-            if tdef and tdef.get("limit"):
-                t_limit     = int(tdef["limit"])
-                t_sold      = _type_sold(db, ticket.ticket_type, ticket.show_date)
-                t_remaining = max(0, t_limit - t_sold)
-                if ticket.quantity > t_remaining:
-                    raise HTTPException(
-                        status_code=409,
-                        detail=(
-                            f"Only {t_remaining} {ticket.ticket_type} ticket(s) remaining for this date."
-                        ),
-                    )
-        except (ValueError, KeyError):
-            pass  # malformed JSON — skip limit check
+        t_limit = settings_typed["type_limits"].get(ticket.ticket_type)
+        if t_limit is not None:
+            t_sold      = sold_by_type.get(ticket.ticket_type, 0)
+            t_remaining = max(0, t_limit - t_sold)
+            if ticket.quantity > t_remaining:
+                raise HTTPException(
+                    status_code=409,
+                    detail=(
+                        f"Only {t_remaining} {ticket.ticket_type} ticket(s) remaining for this date."
+                    ),
+                )
     else:
         # Legacy mode — Early Bird limit only
         if ticket.ticket_type == "Early Bird":
-            eb_limit     = int(settings.get("early_bird_limit", "30") or "30")
-            eb_sold      = _early_bird_sold(db, ticket.show_date)
+            eb_limit     = settings_typed["early_bird_limit"]
+            eb_sold      = sold_by_type.get("Early Bird", 0)
             eb_remaining = max(0, eb_limit - eb_sold)
             if ticket.quantity > eb_remaining:
                 raise HTTPException(
@@ -577,10 +824,9 @@ def register_ticket(
                     ),
                 )
         # Standard limit (if set)
-        std_limit_str = settings.get("standard_limit", "")
-        if std_limit_str and ticket.ticket_type == "Standard":
-            std_limit     = int(std_limit_str)
-            std_sold      = _type_sold(db, "Standard", ticket.show_date)
+        std_limit = settings_typed["standard_limit"]
+        if std_limit is not None and ticket.ticket_type == "Standard":
+            std_sold      = sold_by_type.get("Standard", 0)
             std_remaining = max(0, std_limit - std_sold)
             if ticket.quantity > std_remaining:
                 raise HTTPException(
@@ -590,7 +836,7 @@ def register_ticket(
                     ),
                 )
 
-    ticket_id = secrets.token_urlsafe(16)
+    ticket_id = _new_ticket_id()
     db_ticket = models.Ticket(
         ticket_id        = ticket_id,
         name             = ticket.name,
@@ -604,11 +850,11 @@ def register_ticket(
         payment_status   = "receipt_uploaded" if ticket.receipt_data else "pending",
     )
     db.add(db_ticket)
-    db.commit()
-    db.refresh(db_ticket)
+    # created_at comes back from the INSERT itself (eager_defaults), so no refresh
+    await db.commit()
 
-    # ── Send confirmation email (non-blocking) ────────────────────────────────
-    _send_ticket_email(db_ticket, settings)
+    # ── Send confirmation email (after the response is sent) ──────────────────
+    background_tasks.add_task(_send_ticket_email, _ticket_snapshot(db_ticket), settings)
 
     return db_ticket
 
@@ -617,21 +863,62 @@ def register_ticket(
 # Admin routes  (require X-Admin-Key header)
 # ---------------------------------------------------------------------------
 
+def _decode_data_url(data_url: str) -> tuple[str, bytes]:
+    """Split a base64 data URI (as uploaded by the registration form) into (media_type, bytes)."""
+    header, sep, payload = data_url.partition(",")
+    if not sep:
+        # Bare base64 with no data: prefix
+        return "application/octet-stream", base64.b64decode(header, validate=True)
+    media_type = header.removeprefix("data:").split(";", 1)[0] or "application/octet-stream"
+    return media_type, base64.b64decode(payload, validate=True)
+
+
+# Every Ticket column except the (potentially large) base64 receipt_data —
+# i.e. exactly what TicketResponse and the audit-log details need
+_TICKET_RESPONSE_COLUMNS = (
+    models.Ticket.ticket_id,
+    models.Ticket.name,
+    models.Ticket.email,
+    models.Ticket.phone,
+    models.Ticket.ticket_type,
+    models.Ticket.show_date,
+    models.Ticket.quantity,
+    models.Ticket.payment_status,
+    models.Ticket.receipt_filename,
+    models.Ticket.checked_in,
+    models.Ticket.checked_in_at,
+    models.Ticket.created_at,
+)
+
 @app.get(
     "/api/admin/tickets",
     response_model=schemas.TicketListResponse,
     dependencies=[Depends(verify_any_admin)],
 )
-def get_tickets(db: Session = Depends(get_db)):
-    tickets = (
-        db.query(models.Ticket)
-        .order_by(models.Ticket.created_at.desc())
-        .all()
-    )
-    total_tickets    = sum(t.quantity for t in tickets)
-    checked_in_count = sum(1 for t in tickets if t.checked_in)
+async def get_tickets(
+    db: AsyncSession = Depends(get_db),
+    limit: int = Query(500, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    # Stats cover the whole table; only the listing itself is paginated
+    total, total_tickets, checked_in_count = (await db.execute(
+        select(
+            func.count(models.Ticket.ticket_id),
+            func.coalesce(func.sum(models.Ticket.quantity), 0),
+            func.coalesce(func.sum(case((models.Ticket.checked_in, 1), else_=0)), 0),
+        )
+    )).one()
+    tickets = (await db.scalars(
+        select(models.Ticket)
+        .options(load_only(*_TICKET_RESPONSE_COLUMNS))
+        # ticket_id breaks created_at ties (SQLite stamps whole seconds) so pages
+        # never repeat or skip rows
+        .order_by(models.Ticket.created_at.desc(), models.Ticket.ticket_id.desc())
+        .limit(limit)
+        .offset(offset)
+    )).all()
     return schemas.TicketListResponse(
-        total         = len(tickets),
+        total         = total,
         total_tickets = total_tickets,
         checked_in    = checked_in_count,
         tickets       = tickets,
@@ -642,22 +929,41 @@ def get_tickets(db: Session = Depends(get_db)):
     "/api/admin/receipt/{ticket_id}",
     dependencies=[Depends(verify_any_admin)],
 )
-def get_receipt(ticket_id: str, db: Session = Depends(get_db)):
-    """Return the base64 receipt data for a single ticket."""
-    ticket = (
-        db.query(models.Ticket)
-        .filter(models.Ticket.ticket_id == ticket_id)
-        .first()
-    )
+async def get_receipt(ticket_id: str, db: AsyncSession = Depends(get_db)):
+    """Return the receipt for a single ticket as its original binary file."""
+    ticket = (await db.execute(
+        select(
+            models.Ticket.ticket_id,
+            models.Ticket.receipt_data,
+            models.Ticket.receipt_filename,
+        )
+        .where(models.Ticket.ticket_id == ticket_id)
+    )).first()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found.")
     if not ticket.receipt_data:
         raise HTTPException(status_code=404, detail="No receipt uploaded for this ticket.")
-    return {
-        "ticket_id":       ticket.ticket_id,
-        "receipt_data":    ticket.receipt_data,
-        "receipt_filename": ticket.receipt_filename,
-    }
+    try:
+        media_type, content = _decode_data_url(ticket.receipt_data)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Stored receipt is not valid base64.")
+    # The type comes from the guest's upload — only serve what the form accepts
+    # (SVG excluded: it can carry script), anything else as an opaque download
+    media_type = media_type.lower()
+    if not (
+        (media_type.startswith("image/") and media_type != "image/svg+xml")
+        or media_type == "application/pdf"
+    ):
+        media_type = "application/octet-stream"
+    filename = quote(ticket.receipt_filename or "receipt")
+    return Response(
+        content    = content,
+        media_type = media_type,
+        headers    = {
+            "Content-Disposition":    f"inline; filename*=UTF-8''{filename}",
+            "X-Content-Type-Options": "nosniff",
+        },
+    )
 
 
 @app.patch(
@@ -665,16 +971,14 @@ def get_receipt(ticket_id: str, db: Session = Depends(get_db)):
     response_model=schemas.TicketResponse,
     dependencies=[Depends(verify_dashboard)],
 )
-def update_ticket(
+async def update_ticket(
     ticket_id: str,
     update: schemas.TicketUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Edit any field on an existing ticket (dashboard key required)."""
-    ticket = (
-        db.query(models.Ticket)
-        .filter(models.Ticket.ticket_id == ticket_id)
-        .first()
+    ticket = await db.get(
+        models.Ticket, ticket_id, options=[load_only(*_TICKET_RESPONSE_COLUMNS)]
     )
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found.")
@@ -702,13 +1006,12 @@ def update_ticket(
         changes.append(f"payment_status: '{ticket.payment_status}' → '{update.payment_status}'")
         ticket.payment_status = update.payment_status
 
-    db.commit()
-    db.refresh(ticket)
+    await db.commit()
 
-    detail = f"Edited ticket for {ticket.name} (ID: {ticket_id[:8]}…)"
+    detail = f"Edited ticket for {ticket.name} (ID: {ticket_id})"
     if changes:
         detail += " — " + ", ".join(changes)
-    _log_action(db, "Admin", "edit_ticket", detail)
+    _log_action("Admin", "edit_ticket", detail)
 
     return ticket
 
@@ -718,48 +1021,92 @@ def update_ticket(
     dependencies=[Depends(verify_dashboard)],
     status_code=204,
 )
-def delete_ticket(ticket_id: str, db: Session = Depends(get_db)):
+async def delete_ticket(ticket_id: str, db: AsyncSession = Depends(get_db)):
     """Permanently delete a ticket registration (dashboard key required)."""
-    ticket = (
-        db.query(models.Ticket)
-        .filter(models.Ticket.ticket_id == ticket_id)
-        .first()
+    ticket = await db.get(
+        models.Ticket, ticket_id, options=[load_only(*_TICKET_RESPONSE_COLUMNS)]
     )
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found.")
     detail = (
         f"Deleted ticket for {ticket.name} ({ticket.email}) — "
         f"{ticket.show_date}, {ticket.ticket_type} x{ticket.quantity} "
-        f"(ID: {ticket_id[:8]}…)"
+        f"(ID: {ticket_id})"
     )
-    db.delete(ticket)
-    db.commit()
-    _log_action(db, "Admin", "delete_ticket", detail)
+    await db.delete(ticket)
+    await db.commit()
+    _log_action("Admin", "delete_ticket", detail)
     return Response(status_code=204)
 
 
+@app.post(
+    "/api/admin/resend-emails",
+    dependencies=[Depends(verify_dashboard)],
+    status_code=202,
+)
+async def resend_emails(
+    background_tasks: BackgroundTasks,
+    show_date: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Re-send confirmation emails for all tickets, or one show date (dashboard key required)."""
+    if not BREVO_API_KEY or not BREVO_FROM_EMAIL:
+        raise HTTPException(status_code=503, detail="Email is not configured.")
+
+    settings = await get_all_settings(db)
+    query    = (
+        select(models.Ticket)
+        .options(load_only(*_TICKET_RESPONSE_COLUMNS))
+        .order_by(models.Ticket.created_at)
+    )
+    if show_date:
+        query = query.where(models.Ticket.show_date == show_date)
+    tickets = [_ticket_snapshot(t) for t in (await db.scalars(query)).all()]
+
+    if tickets:
+        background_tasks.add_task(_send_bulk_emails, tickets, settings)
+    _log_action(
+        "Admin", "resend_emails",
+        f"Queued {len(tickets)} confirmation email(s)"
+        + (f" for {show_date}" if show_date else " for all show dates"),
+    )
+    return {"queued": len(tickets)}
+
+
 @app.post(
     "/api/admin/checkin",
     response_model=schemas.CheckinResponse,
     dependencies=[Depends(verify_scanner)],
 )
-def checkin_ticket(
+async def checkin_ticket(
     checkin: schemas.CheckinRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    ticket = (
-        db.query(models.Ticket)
-        .filter(models.Ticket.ticket_id == checkin.ticket_id)
-        .first()
-    )
+    # Conditional UPDATE … RETURNING: one round trip, and two scanners racing on
+    # the same ticket can't both succeed
+    ticket = (await db.execute(
+        update(models.Ticket)
+        .where(
+            models.Ticket.ticket_id  == checkin.ticket_id,
+            models.Ticket.checked_in == False,  # noqa: E712
+        )
+        .values(checked_in=True, checked_in_at=func.now())
+        .returning(*_TICKET_RESPONSE_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )).first()
+    await db.commit()
 
     if not ticket:
-        raise HTTPException(status_code=404, detail="Ticket not found.")
-
-    if ticket.checked_in:
+        # No row updated — tell "unknown ticket" apart from "already checked in"
+        existing = (await db.execute(
+            select(models.Ticket.checked_in_at)
+            .where(models.Ticket.ticket_id == checkin.ticket_id)
+        )).first()
+        if not existing:
+            raise HTTPException(status_code=404, detail="Ticket not found.")
         time_str = (
-            ticket.checked_in_at.strftime("%H:%M:%S")
-            if ticket.checked_in_at
+            existing.checked_in_at.strftime("%H:%M:%S")
+            if existing.checked_in_at
             else "unknown time"
         )
         raise HTTPException(
@@ -767,13 +1114,8 @@ def checkin_ticket(
             detail=f"Ticket already checked in at {time_str}.",
         )
 
-    ticket.checked_in    = True
-    ticket.checked_in_at = datetime.utcnow()
-    db.commit()
-    db.refresh(ticket)
-
     _log_action(
-        db, "Scanner", "checkin",
+        "Scanner", "checkin",
         f"Checked in {ticket.name} ({ticket.show_date}, {ticket.ticket_type} x{ticket.quantity})"
     )
 
@@ -792,23 +1134,38 @@ def checkin_ticket(
     "/api/admin/audit",
     dependencies=[Depends(verify_backstage)],
 )
-def get_audit_log(db: Session = Depends(get_db), limit: int = 200):
-    """Return the most recent audit log entries (dashboard key required)."""
-    entries = (
-        db.query(models.AuditLog)
-        .order_by(models.AuditLog.timestamp.desc())
-        .limit(limit)
-        .all()
-    )
-    return {
-        "entries": [
-            {
-                "id":        e.id,
-                "timestamp": e.timestamp.isoformat() if e.timestamp else None,
-                "role":      e.role,
-                "action":    e.action,
-                "detail":    e.detail,
-            }
-            for e in entries
-        ]
-    }
+async def get_audit_log(limit: int = Query(200, ge=1, le=5000)):
+    """Return the most recent audit log entries (dashboard key required).
+    Streamed row by row, so memory stays flat however large `limit` is. Bounded
+    up front: once streaming starts, a database error can't become an error status."""
+    async def _generate():
+        # Own session: a Depends(get_db) session is closed before the body streams
+        async with SessionLocal() as session:
+            rows = await session.stream(
+                select(
+                    models.AuditLog.id,
+                    models.AuditLog.timestamp,
+                    models.AuditLog.role,
+                    models.AuditLog.action,
+                    models.AuditLog.detail,
+                )
+                .order_by(models.AuditLog.timestamp.desc())
+                .limit(limit)
+                .execution_options(yield_per=200)
+            )
+            yield b'{"entries":['
+            first = True
+            async for e in rows:
+                if not first:
+                    yield b","
+                first = False
+                yield orjson.dumps({
+                    "id":        e.id,
+                    "timestamp": e.timestamp.isoformat() if e.timestamp else None,
+                    "role":      e.role,
+                    "action":    e.action,
+                    "detail":    e.detail,
+                })
+            yield b"]}"
+
+    return StreamingResponse(_generate(), media_type="application/json")
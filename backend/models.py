@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Boolean, DateTime, Integer, Text
+from sqlalchemy import Column, String, Boolean, DateTime, Integer, Text, Index
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from database import Base
 
@@ -24,8 +25,10 @@ class Ticket(Base):
     ticket_type      = Column(String(50),  nullable=False)
     show_date        = Column(String(20),  nullable=False)
     quantity         = Column(Integer,     default=1, nullable=False)
-    # Receipt stored as base64 data URI — sufficient for small-scale events
-    receipt_data     = Column(Text,        nullable=True)
+    # Receipt stored as base64 data URI — sufficient for small-scale events.
+    # Deferred: only loaded when explicitly selected (see /api/admin/receipt),
+    # so ticket listings never pull the blob (Postgres keeps it out-of-line in TOAST)
+    receipt_data     = deferred(Column(Text, nullable=True))
     receipt_filename = Column(String(255), nullable=True)
     # 'pending' | 'receipt_uploaded'
     payment_status   = Column(String(20),  default='pending', nullable=False)
@@ -37,6 +40,17 @@ class Ticket(Base):
         nullable=False
     )
 
+    # Fetch server-generated created_at via INSERT ... RETURNING at flush time,
+    # so callers never need a follow-up refresh SELECT
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # Covers the per-date / per-type SUM(quantity) availability aggregates
+        Index("ix_ticket_show_date_type", "show_date", "ticket_type"),
+        # Admin ticket list: ORDER BY created_at DESC, ticket_id DESC
+        Index("ix_ticket_created_at_id", created_at.desc(), ticket_id.desc()),
+    )
+
 
 # ── Audit log ────────────────────────────────────────────────────────────────
 class AuditLog(Base):
@@ -46,5 +60,10 @@ class AuditLog(Base):
     id        = Column(Integer,  primary_key=True, autoincrement=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     role      = Column(String(20),  nullable=False)   # Admin | Finance | Scanner
-    action    = Column(String(50),  nullable=False)   # login | edit_ticket | delete_ticket | update_settings | checkin
+    action    = Column(String(50),  nullable=False)   # login | edit_ticket | delete_ticket | update_settings | checkin | resend_emails
     detail    = Column(Text,        nullable=False)
+
+    __table_args__ = (
+        # Backstage view: ORDER BY timestamp DESC LIMIT n
+        Index("ix_audit_timestamp", timestamp.desc()),
+    )
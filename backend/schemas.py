@@ -1,7 +1,12 @@
-from pydantic import BaseModel, field_validator
+import re
+from pydantic import BaseModel, ConfigDict, field_validator
 from datetime import datetime
 from typing import Optional, List
 
+# local@domain.tld — no whitespace, exactly one @, and a domain of two or more
+# non-empty dot-separated labels (no leading, trailing or doubled dots)
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s.]+(?:\.[^@\s.]+)+$")
+
 
 class TicketCreate(BaseModel):
     name: str
@@ -24,7 +29,7 @@ class TicketCreate(BaseModel):
     @classmethod
     def email_must_be_valid(cls, v: str) -> str:
         v = v.strip().lower()
-        if "@" not in v or "." not in v.split("@")[-1]:
+        if not _EMAIL_RE.match(v):
             raise ValueError("Invalid email address")
         return v
 
@@ -51,7 +56,7 @@ class TicketResponse(BaseModel):
     checked_in_at: Optional[datetime] = None
     created_at: Optional[datetime] = None
 
-    model_config = {"from_attributes": True}
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TicketListResponse(BaseModel):
@@ -84,7 +89,7 @@ class TicketUpdate(BaseModel):
         if v is None:
             return v
         v = v.strip().lower()
-        if "@" not in v or "." not in v.split("@")[-1]:
+        if not _EMAIL_RE.match(v):
             raise ValueError("Invalid email address")
         return v
 